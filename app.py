@@ -1,13 +1,26 @@
-import time
-from collections import defaultdict
+import hashlib
+import mmap
+import os
+import re
+from collections import OrderedDict, defaultdict
 from pathlib import Path
 
 from ifcopenshell import open as openIFC
-from ifcopenshell.util.element import get_psets
+from ifcopenshell.util.element import get_pset
 
 import viktor as vkt
 
-PROGRESS_MESSAGE_DELAY = 3  # seconds
+# a parsed model takes roughly 8.5 times its file size in memory, so this keeps at most ~425 MB of models
+MODEL_CACHE_MAX_BYTES = 50_000_000  # total size of the IFC files whose parsed models are kept in memory
+
+_model_cache = OrderedDict()  # content hash -> (parsed model, file size in bytes)
+
+# STEP (ISO 10303-21) syntax used to filter IFC files on the text level
+_SECTION_TOKEN_RE = re.compile(rb"'(?:[^']|'')*+'|/\*.*?\*/|(?<![\w-])DATA\s*;", re.DOTALL)
+_RECORD_RE = re.compile(
+    rb"/\*.*?\*/|#(\d+)\s*=((?:[^;'/]++|'(?:[^']|'')*+'|/\*.*?\*/|/)*+);([ \t]*(?:\r?\n)?)", re.DOTALL
+)
+_TOKEN_RE = re.compile(rb"'(?:[^']|'')*+'|/\*.*?\*/|#(\d+)|[(),]|[^'#(),/]+|/", re.DOTALL)
 
 
 def _use_correct_file(params) -> vkt.File:
@@ -19,58 +32,158 @@ def _use_correct_file(params) -> vkt.File:
     return vkt.File.from_path(Path(__file__).parent / "AC20-Institute-Var-2.ifc")
 
 
-def _load_ifc_file(params):
-    """Load ifc file into ifc model object."""
-    ifc_upload = _use_correct_file(params)
-    path = ifc_upload.copy().source
-    model = openIFC(path)
+def _use_local_file(params) -> vkt.File:
+    """
+    Returns the file of `_use_correct_file` on local disk. Only uploads are copied; the default file
+    already is a local path.
+    """
+    ifc_file = _use_correct_file(params)
+    if ifc_file.source_type == vkt.File.SourceType.PATH:
+        return ifc_file
+    return ifc_file.copy()
+
+
+def _file_hash(file: vkt.File) -> str:
+    """Return the SHA-256 hex digest of the file content, read in chunks."""
+    sha = hashlib.sha256()
+    with file.open_binary() as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _load_cached_ifc_file(ifc_file: vkt.File):
+    """
+    Load a local ifc file into ifc model object, reusing an earlier parse of a file with the same content.
+    Least recently used models are evicted once their files exceed `MODEL_CACHE_MAX_BYTES` in total; the
+    most recent model is always kept. The returned model is shared between calls, so it must not be
+    modified.
+    """
+    key = _file_hash(ifc_file)
+    if key in _model_cache:
+        _model_cache.move_to_end(key)
+        return _model_cache[key][0]
+    model = openIFC(ifc_file.source)
+    _model_cache[key] = (model, os.path.getsize(ifc_file.source))
+    while len(_model_cache) > 1 and sum(size for _, size in _model_cache.values()) > MODEL_CACHE_MAX_BYTES:
+        _model_cache.popitem(last=False)
     return model
 
 
+def _strip_references(record: bytes, removed_ids: set) -> bytes:
+    """
+    Remove the references to `removed_ids` from the attributes of a STEP record, the same way
+    `ifcopenshell.file.remove` does: references in a list are dropped from that list, while
+    references held directly by an attribute are replaced by `$`.
+    """
+    lists = [[b""]]  # stack of open lists, each holding its items; None marks a dropped item
+    for token in _TOKEN_RE.finditer(record):
+        value = token.group()
+        if token.group(1) is not None and int(token.group(1)) in removed_ids:
+            if len(lists) <= 2:
+                value = b"$"
+            else:
+                lists[-1][-1] = None
+                continue
+        if value == b"(":
+            lists.append([b""])
+        elif value == b")":
+            items = lists.pop()
+            lists[-1][-1] += b"(" + b",".join(item for item in items if item is not None) + b")"
+        elif value == b"," and len(lists) > 1:
+            lists[-1].append(b"")
+        elif lists[-1][-1] is not None:
+            lists[-1][-1] += value
+    return lists[0][0]
+
+
+def _find_data_section(content) -> int:
+    """
+    Return the offset right after the `DATA;` keyword of STEP `content`, skipping strings and comments
+    in the header, or -1 if the file has no DATA section.
+    """
+    for token in _SECTION_TOKEN_RE.finditer(content):
+        if token.group().startswith(b"DATA"):
+            return token.end()
+    return -1
+
+
+def _write_filtered_ifc_file(source: vkt.File, target: vkt.File, removed_ids: set, referencing_ids: set) -> bool:
+    """
+    Write the local IFC file `source` to `target` without the records in `removed_ids`. This works on
+    the memory-mapped STEP text directly, so the file does not have to be re-parsed and re-serialized by
+    ifcopenshell, and unchanged stretches of records are copied as-is. The records in `referencing_ids`
+    are the only ones referring to removed records; those references are stripped. Comments are skipped.
+    Returns False if the file has no DATA section, or if not every removed or referencing record was found
+    exactly once (i.e. the record structure could not be followed); the target is then not usable.
+    """
+    with open(source.source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        start = _find_data_section(content)
+        if start < 0:
+            return False
+
+        matched_ids = []  # removed and referencing records that were found
+        with open(target.source, "wb") as out:
+            position = 0  # start of the content that still has to be written
+            for record in _RECORD_RE.finditer(content, start):
+                if record.group(1) is None:  # comment
+                    continue
+                record_id = int(record.group(1))
+                if record_id in removed_ids:
+                    out.write(content[position : record.start()])
+                    position = record.end()
+                    matched_ids.append(record_id)
+                elif record_id in referencing_ids:
+                    out.write(content[position : record.start()])
+                    stripped = _strip_references(record.group(2), removed_ids)
+                    out.write(b"#%d=%s;%s" % (record_id, stripped, record.group(3)))
+                    position = record.end()
+                    matched_ids.append(record_id)
+            out.write(content[position:])
+    return len(matched_ids) == len(set(matched_ids)) == len(removed_ids) + len(referencing_ids)
+
+
+def _remove_and_write_ifc_file(source: vkt.File, target: vkt.File, removed_ids: set):
+    """
+    Fallback for `_write_filtered_ifc_file`: open a private model of the local IFC file `source`, remove
+    the entities in `removed_ids` through ifcopenshell and write the result to `target`.
+    """
+    model = openIFC(source.source)
+    for entity_id in removed_ids:
+        model.remove(model.by_id(entity_id))
+    model.write(target.source)
+
+
 def get_filtered_ifc_file(params, **kwargs) -> vkt.File:
     """
-    Filter an IFC file based on selected elements and return the filtered file. This method Loads
-    the IFC file. Then,  it filters out elements that are not in the `selected_elements` set, while it
-    provides progress messages during the filtering process, avoiding any flooding of the message queue.
-    In doing so, it removes all elements of type `IfcElement`, `IfcSpace` and IfcSite` that are not selected.
-    Finally, it returns the filtered IFC as a VIKTOR file.
+    Filter an IFC file based on selected elements and return the filtered file. This method loads
+    the (cached) IFC model to find the elements that are not in the `selected_elements` set, which
+    are all elements of type `IfcElement` that are not selected, along with all `IfcSpace` and `IfcSite`
+    elements. Then, it writes a copy of the IFC file without those elements, stripping them from the
+    STEP text directly, or through ifcopenshell if the text cannot be filtered. Finally, it returns the
+    filtered IFC as a VIKTOR file.
     """
     selected_elements = {int(element) for element in params.selected_elements}
     vkt.progress_message("Load IFC file...")
-    model = _load_ifc_file(params)
-
-    # initialize the variables responsible for progress message delays
-    delta_time = PROGRESS_MESSAGE_DELAY + 1
-    start = time.time()
-
-    # remove all other parts from the ifc file which are not viewed
-    for element in model.by_type("IfcElement"):
-        if element.id() not in selected_elements:
-            if delta_time > PROGRESS_MESSAGE_DELAY:
-                # the logic of progress message delays is implemented
-                # to avoid cases where the progress messages
-                # flood the progress message queue
-                start = time.time()
-                vkt.progress_message(f"Removing element: {element.get_info()['type']}")
-            model.remove(element)
-        delta_time = time.time() - start
-    
-    # remove other types
+    ifc_file = _use_local_file(params)
+    model = _load_cached_ifc_file(ifc_file)  # shared with other calls: read only, never modify it
+
+    # remove all other parts from the ifc file which are not viewed, and the other types
+    removed_elements = [
+        element for element in model.by_type("IfcElement") if element.id() not in selected_elements
+    ]
     for t in ("IfcSpace", "IfcSite"):
-        for element in model.by_type(t):
-            if delta_time > PROGRESS_MESSAGE_DELAY:
-                # the logic of progress message delays is implemented
-                # to avoid cases where the progress messages
-                # flood the progress message queue
-                start = time.time()
-                vkt.progress_message(f"Removing element: {element.get_info()['type']}")
-            model.remove(element)
-            delta_time = time.time() - start
+        removed_elements.extend(model.by_type(t))
+    removed_ids = {element.id() for element in removed_elements}
+    referencing_ids = {
+        inverse.id() for element in removed_elements for inverse in model.get_inverse(element)
+    } - removed_ids
 
     # part where we save the model as seen in the viewer
-    vkt.progress_message("Exporting file...")
+    vkt.progress_message(f"Exporting file without {len(removed_ids)} elements...")
     file = vkt.File()
-    model.write(file.source)
+    if not _write_filtered_ifc_file(ifc_file, file, removed_ids, referencing_ids):
+        _remove_and_write_ifc_file(ifc_file, file, removed_ids)
     return file
 
 
@@ -155,7 +268,7 @@ class Controller(vkt.ViktorController):
                     )
                 ],
             )
-        model = _load_ifc_file(params)
+        model = _load_cached_ifc_file(_use_local_file(params))  # shared with other calls: read only
         try:
             _objects = [model.by_id(int(id_)) for id_ in params.selected_elements]
         except RuntimeError:
@@ -171,7 +284,7 @@ class Controller(vkt.ViktorController):
 
         objects_by_type = defaultdict(list)
         for obj in _objects:
-            objects_by_type[obj.get_info()["type"]].append(obj)
+            objects_by_type[obj.is_a()].append(obj)
 
         top_level_items = [
             vkt.DataItem(
@@ -185,9 +298,7 @@ class Controller(vkt.ViktorController):
             for obj_ in object_list:
                 low_level_items = [
                     vkt.DataItem(key, val)
-                    for key, val in get_psets(obj_)
-                    .get(params.relevant_pset, {})
-                    .items()
+                    for key, val in (get_pset(obj_, params.relevant_pset) or {}).items()
                 ]
                 if low_level_items:
                     mid_level_items.append(